@@ -0,0 +1,91 @@
+import json
+import logging
+
+from openai import NotFoundError, OpenAIError
+
+log = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# Batch states that are still worth polling
+PENDING_STATUSES = {"validating", "in_progress", "finalizing"}
+
+# Reported for a completed batch whose files were deleted when its results were first collected
+COLLECTED_STATUS = "collected"
+
+async def delete_files(aclient, *file_ids):
+    """
+    Deletes uploaded or generated batch files, logging and skipping any that cannot be deleted.
+    """
+    for file_id in file_ids:
+        if not file_id:
+            continue
+        try:
+            await aclient.files.delete(file_id)
+        except OpenAIError as e:
+            log.warning("Could not delete batch file %s: %s", file_id, e)
+
+async def submit_batch(aclient, queries, build_request):
+    """
+    Submits one chat completion per query through the OpenAI Batch API and returns the batch id.
+    """
+    lines = [
+        json.dumps({"custom_id": str(index), "method": "POST", "url": BATCH_ENDPOINT, "body": build_request(query)})
+        for index, query in enumerate(queries)
+    ]
+    batch_file = await aclient.files.create(
+        file=("batch.jsonl", "\n".join(lines).encode()),
+        purpose="batch",
+    )
+
+    try:
+        submitted = await aclient.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+    except OpenAIError:
+        await delete_files(aclient, batch_file.id)
+        raise
+    log.info("Submitted batch %s with %s queries.", submitted.id, len(queries))
+    return submitted.id
+
+async def collect_batch(aclient, batch_id, request_query):
+    """
+    Returns (status, queries, replies) for a batch. The queries are rebuilt from the batch's
+    input file with request_query(body); replies are listed in submission order, with None
+    for requests that failed. Both lists are None until the batch has completed.
+
+    The batch's files are deleted once it has finished, so the results of a completed batch
+    can be collected once; later polls report COLLECTED_STATUS.
+    """
+    current = await aclient.batches.retrieve(batch_id)
+    if current.status in PENDING_STATUSES:
+        return current.status, None, None
+    if current.status != "completed":
+        await delete_files(aclient, current.input_file_id, current.error_file_id)
+        return current.status, None, None
+
+    try:
+        input_file = await aclient.files.content(current.input_file_id)
+    except NotFoundError:
+        return COLLECTED_STATUS, None, None
+    queries = {}
+    for line in input_file.text.splitlines():
+        item = json.loads(line)
+        queries[int(item["custom_id"])] = request_query(item["body"])
+    queries = [queries[index] for index in range(len(queries))]
+
+    replies = [None] * len(queries)
+    if current.output_file_id:
+        output = await aclient.files.content(current.output_file_id)
+        for line in output.text.splitlines():
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") == 200:
+                replies[int(item["custom_id"])] = response["body"]["choices"][0]["message"]["content"].strip()
+            else:
+                log.error("Batch %s request %s failed: %s", batch_id, item["custom_id"], item.get("error"))
+
+    await delete_files(aclient, current.input_file_id, current.output_file_id, current.error_file_id)
+    return current.status, queries, replies
@@ -0,0 +1,24 @@
+import functools
+import logging
+
+from kubernetes import client, config
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=1)
+def get_v1():
+    """
+    Loads the kubeconfig once per process and returns the shared CoreV1Api client.
+    Failures are not cached, so a later call tries again.
+    """
+    config.load_kube_config(config_file="~/.kube/config")
+
+    # Size the connection pool for the worker threads that run Kubernetes calls concurrently
+    kube_configuration = client.Configuration.get_default_copy()
+    kube_configuration.connection_pool_maxsize = 64
+    kube_configuration.retries = Retry(total=2, backoff_factor=0.1)
+    client.Configuration.set_default(kube_configuration)
+
+    log.info("Kubernetes configuration loaded successfully.")
+    return client.CoreV1Api()
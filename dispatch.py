@@ -0,0 +1,355 @@
+import ast
+import functools
+import threading
+import time
+from typing import NamedTuple
+
+import ijson
+from kubernetes import client
+
+from bootstrap import get_v1
+
+class CommandPlan(NamedTuple):
+    """
+    A generated command reduced to a single read call on the v1 client.
+
+    shape is "call" for `v1.<method>(...).<path>`, "items" for a list comprehension that
+    projects `<item>.<path>` over `.items`, and "count" for `len(...)` of either form.
+    filters holds the (path, value) equality conditions applied to each item.
+    """
+    method: str
+    args: tuple
+    kwargs: tuple
+    shape: str
+    path: tuple
+    filters: tuple
+
+# Only read-only client methods are dispatched directly
+READ_PREFIXES = ("list_", "read_")
+# Client keywords that turn a read into a long-running watch or hand back the raw response
+UNSAFE_KEYWORDS = {"watch", "_preload_content"}
+# Builtins that would let a generated command reach past the read-only v1 calls
+UNSAFE_NAMES = {"eval", "exec", "compile", "open", "getattr", "setattr", "delattr", "globals", "locals", "vars", "__import__"}
+LITERAL_TYPES = (str, int, float, bool, type(None))
+
+# List calls answered from raw JSON are fetched in pages of this size
+LIST_PAGE_SIZE = 500
+
+# Short-lived cache of dispatched results, shared by the worker threads
+PLAN_RESULT_TTL = 5
+plan_results = {}
+plan_results_lock = threading.Lock()
+
+def split_attributes(node):
+    """
+    Splits `base.a.b.c` into (base, ("a", "b", "c")).
+    """
+    path = []
+    while isinstance(node, ast.Attribute):
+        path.append(node.attr)
+        node = node.value
+    return node, tuple(reversed(path))
+
+def read_call(node):
+    """
+    Returns (method, args, kwargs) when node is a read call on v1 with literal arguments.
+    """
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+            and isinstance(node.func.value, ast.Name) and node.func.value.id == "v1"):
+        return None
+
+    method = node.func.attr
+    if not method.startswith(READ_PREFIXES) or not hasattr(client.CoreV1Api, method):
+        return None
+    if any(keyword.arg is None or keyword.arg in UNSAFE_KEYWORDS for keyword in node.keywords):
+        return None
+
+    try:
+        args = tuple(ast.literal_eval(arg) for arg in node.args)
+        kwargs = tuple((keyword.arg, ast.literal_eval(keyword.value)) for keyword in node.keywords)
+    except (ValueError, TypeError, SyntaxError):
+        return None
+
+    if not all(isinstance(value, LITERAL_TYPES) for value in args + tuple(value for _, value in kwargs)):
+        return None
+    return method, args, kwargs
+
+def plan_comprehension(node):
+    """
+    Plans `[x.<path> for x in v1.<method>(...).items if x.<path> == <literal> ...]`.
+    """
+    if not isinstance(node, ast.ListComp) or len(node.generators) != 1:
+        return None
+    generator = node.generators[0]
+    if generator.is_async or not isinstance(generator.target, ast.Name):
+        return None
+    item = generator.target.id
+
+    base, path = split_attributes(generator.iter)
+    call = read_call(base)
+    if not call or path != ("items",):
+        return None
+
+    base, element_path = split_attributes(node.elt)
+    if not (isinstance(base, ast.Name) and base.id == item):
+        return None
+
+    filters = []
+    for condition in generator.ifs:
+        if not (isinstance(condition, ast.Compare) and len(condition.ops) == 1
+                and isinstance(condition.ops[0], ast.Eq)):
+            return None
+        base, filter_path = split_attributes(condition.left)
+        if not (isinstance(base, ast.Name) and base.id == item and filter_path):
+            return None
+        try:
+            value = ast.literal_eval(condition.comparators[0])
+        except (ValueError, TypeError, SyntaxError):
+            return None
+        if not isinstance(value, LITERAL_TYPES):
+            return None
+        filters.append((filter_path, value))
+
+    return CommandPlan(*call, "items", element_path, tuple(filters))
+
+def scope_to_namespace(plan):
+    """
+    Turns a cluster-wide list filtered on metadata.namespace into the namespaced list call,
+    so the API server only returns that namespace.
+    """
+    if not plan.method.endswith("_for_all_namespaces"):
+        return plan
+    for condition in plan.filters:
+        path, value = condition
+        if path != ("metadata", "namespace") or not isinstance(value, str):
+            continue
+        method = "list_namespaced_" + plan.method[len("list_"):-len("_for_all_namespaces")]
+        if hasattr(client.CoreV1Api, method):
+            return plan._replace(
+                method=method,
+                kwargs=plan.kwargs + (("namespace", value),),
+                filters=tuple(other for other in plan.filters if other != condition),
+            )
+    return plan
+
+@functools.lru_cache(maxsize=256)
+def plan_command(command):
+    """
+    Recognizes the common `result = ...` shapes of generated commands so they can be
+    dispatched straight to the client. Returns None for anything else.
+    """
+    try:
+        tree = ast.parse(command)
+    except SyntaxError:
+        return None
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Assign):
+        return None
+    if any(isinstance(node, ast.Attribute) and node.attr.startswith("__") for node in ast.walk(tree)):
+        return None
+    statement = tree.body[0]
+    if len(statement.targets) != 1 or not (isinstance(statement.targets[0], ast.Name)
+                                           and statement.targets[0].id == "result"):
+        return None
+    value = statement.value
+
+    # len(v1.<method>(...).items) or len([... for x in v1.<method>(...).items ...])
+    if (isinstance(value, ast.Call) and isinstance(value.func, ast.Name) and value.func.id == "len"
+            and len(value.args) == 1 and not value.keywords):
+        plan = plan_comprehension(value.args[0])
+        if plan:
+            return scope_to_namespace(plan._replace(shape="count"))
+        base, path = split_attributes(value.args[0])
+        call = read_call(base)
+        if call and path == ("items",):
+            return CommandPlan(*call, "count", (), ())
+        return None
+
+    plan = plan_comprehension(value)
+    if plan:
+        return scope_to_namespace(plan)
+
+    # v1.<method>(...).<path>
+    base, path = split_attributes(value)
+    call = read_call(base)
+    if call:
+        return CommandPlan(*call, "call", path, ())
+    return None
+
+def looks_like_command(command):
+    """
+    Safety check for a generated command: a single statement that assigns 'result' and
+    either matches a dispatcher shape or only ever calls list_/read_ methods on 'v1'.
+    """
+    if not command or "\n" in command or "v1." not in command or "result" not in command:
+        return False
+    if plan_command(command):
+        return True
+    try:
+        tree = ast.parse(command)
+    except SyntaxError:
+        return False
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Assign):
+        return False
+
+    # Every use of v1 must be a direct attribute lookup, so the client cannot be aliased
+    client_lookups = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "v1":
+            client_lookups.add(id(node.value))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "v1" and id(node) not in client_lookups:
+            return False
+        if isinstance(node, ast.Name) and (node.id in UNSAFE_NAMES or node.id.startswith("__")):
+            return False
+        if isinstance(node, ast.Attribute):
+            if node.attr.startswith("__"):
+                return False
+            if isinstance(node.value, ast.Name) and node.value.id == "v1" and not node.attr.startswith(READ_PREFIXES):
+                return False
+        if isinstance(node, ast.Call) and any(
+                keyword.arg is None or keyword.arg in UNSAFE_KEYWORDS for keyword in node.keywords):
+            return False
+    return True
+
+def resolve_attributes(obj, path):
+    """
+    Follows an attribute path such as ("metadata", "name") from obj.
+    """
+    for name in path:
+        obj = getattr(obj, name)
+    return obj
+
+def run_model_plan(plan):
+    """
+    Runs a CommandPlan through the client's usual model deserialization.
+    """
+    response = getattr(get_v1(), plan.method)(*plan.args, **dict(plan.kwargs))
+    if plan.shape == "call":
+        return resolve_attributes(response, plan.path)
+
+    items = [
+        item for item in response.items
+        if all(resolve_attributes(item, path) == value for path, value in plan.filters)
+    ]
+    if plan.shape == "count":
+        return len(items)
+    return [resolve_attributes(item, plan.path) for item in items]
+
+def uses_raw_json(plan):
+    """
+    Whether a plan can be answered from the raw list JSON. Attribute names with underscores
+    are renamed between the client models and the JSON, so those need the models.
+    """
+    paths = [plan.path] + [path for path, _ in plan.filters]
+    return (plan.shape != "call" and plan.method.startswith("list_")
+            and (plan.shape == "count" or plan.path)
+            and not any("_" in name for path in paths for name in path)
+            and not any(name in ("limit", "_continue", "watch", "_preload_content") for name, _ in plan.kwargs))
+
+def fetch_raw_page(method, args, kwargs, fields, limit, token):
+    """
+    Streams one page of a list call and returns (rows, continue token, remaining item count).
+    Each row maps the requested field paths to their values for one item; fields missing
+    from an item are left out. Nothing else in the response is materialized.
+    """
+    kwargs = dict(kwargs, limit=limit, _preload_content=False)
+    if token:
+        kwargs["_continue"] = token
+    response = getattr(get_v1(), method)(*args, **kwargs)
+
+    prefixes = {".".join(("items", "item") + path): path for path in fields}
+    rows, row, token, remaining = [], None, None, None
+    # Builders for requested fields whose values are objects or arrays: [path, builder, depth]
+    building = []
+    try:
+        for prefix, event, value in ijson.parse(response, use_float=True):
+            for entry in building:
+                entry[1].event(event, value)
+                entry[2] += (event in ("start_map", "start_array")) - (event in ("end_map", "end_array"))
+            for entry in [entry for entry in building if entry[2] == 0]:
+                row[entry[0]] = entry[1].value
+                building.remove(entry)
+
+            if prefix == "items.item" and event == "start_map":
+                row = {}
+            elif prefix == "items.item" and event == "end_map":
+                rows.append(row)
+            elif prefix in prefixes and event in ("start_map", "start_array"):
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+                building.append([prefixes[prefix], builder, 1])
+            elif prefix in prefixes and event in ("string", "number", "boolean", "null"):
+                row[prefixes[prefix]] = value
+            elif prefix == "metadata.continue":
+                token = value
+            elif prefix == "metadata.remainingItemCount":
+                remaining = value
+    finally:
+        response.release_conn()
+    return rows, token, remaining
+
+def stream_list(method, args, kwargs, fields):
+    """
+    Yields one row of requested fields per item across all pages of a list call.
+    """
+    token = None
+    while True:
+        rows, token, _ = fetch_raw_page(method, args, kwargs, fields, LIST_PAGE_SIZE, token)
+        yield from rows
+        if not token:
+            return
+
+def kube_names(resource, namespace=None, **kwargs):
+    """
+    Lists the names of a kind of resource without deserializing the objects, e.g.
+    kube_names("namespace") or kube_names("pod", namespace="test").
+    """
+    if namespace:
+        method = f"list_namespaced_{resource}"
+        kwargs["namespace"] = namespace
+    elif hasattr(client.CoreV1Api, f"list_{resource}_for_all_namespaces"):
+        method = f"list_{resource}_for_all_namespaces"
+    else:
+        method = f"list_{resource}"
+    return [row.get(("metadata", "name")) for row in stream_list(method, (), kwargs, [("metadata", "name")])]
+
+def run_raw_plan(plan):
+    """
+    Answers a list plan by streaming only the fields it needs out of the paginated raw JSON,
+    instead of building fully hydrated client models.
+    """
+    kwargs = dict(plan.kwargs)
+    if plan.shape == "count" and not plan.filters:
+        # A one-item page reports how many items remain, so plain counts need no item bodies
+        rows, token, remaining = fetch_raw_page(plan.method, plan.args, kwargs, [], 1, None)
+        if remaining is not None or not token:
+            return len(rows) + (remaining or 0)
+
+    fields = {path for path, _ in plan.filters}
+    if plan.shape == "items":
+        fields.add(plan.path)
+    results = [
+        row.get(plan.path)
+        for row in stream_list(plan.method, plan.args, kwargs, list(fields))
+        if all(row.get(path) == value for path, value in plan.filters)
+    ]
+    return len(results) if plan.shape == "count" else results
+
+def run_plan(plan):
+    """
+    Runs a CommandPlan against the shared v1 client, reusing results fetched within the last
+    PLAN_RESULT_TTL seconds.
+    """
+    now = time.monotonic()
+    with plan_results_lock:
+        cached = plan_results.get(plan)
+    if cached and now - cached[0] < PLAN_RESULT_TTL:
+        return cached[1]
+
+    result = run_raw_plan(plan) if uses_raw_json(plan) else run_model_plan(plan)
+
+    with plan_results_lock:
+        if len(plan_results) >= 256:
+            plan_results.clear()
+        plan_results[plan] = (now, result)
+    return result
@@ -0,0 +1,48 @@
+import re
+
+# Generated suffixes Kubernetes appends to names (pod-template hash and/or random pod suffix),
+# drawn from the alphabet Kubernetes uses for generated names
+NAME_SUFFIX = re.compile(
+    r"(?:-[bcdfghjklmnpqrstvwxz2456789]{6,10})?-[bcdfghjklmnpqrstvwxz2456789]{5}$"
+    r"|-[bcdfghjklmnpqrstvwxz2456789]{6,10}$"
+)
+
+SCALAR_TYPES = (str, bool, int, float)
+COLLECTION_TYPES = (list, tuple, set)
+
+def is_empty_result(result):
+    """
+    Whether a result is an empty string, or a collection with nothing but empty strings in
+    it, which needs a worded answer.
+    """
+    if isinstance(result, COLLECTION_TYPES):
+        return all(item == "" for item in result)
+    return result == ""
+
+def format_scalar(value):
+    """
+    Formats a single value, dropping generated name suffixes from strings.
+    """
+    return NAME_SUFFIX.sub("", value) if isinstance(value, str) else str(value)
+
+def format_result_local(result):
+    """
+    Formats plain results without a model call: generated name suffixes are dropped
+    ('mongodb-56c598c8fc' becomes 'mongodb') and lists are joined, skipping empty strings.
+    Returns None for results that need summarizing, including empty ones, which need a
+    worded answer.
+    """
+    if is_empty_result(result):
+        return None
+    if isinstance(result, SCALAR_TYPES):
+        return format_scalar(result)
+    if isinstance(result, COLLECTION_TYPES) and all(isinstance(item, SCALAR_TYPES) for item in result):
+        return ", ".join(format_scalar(item) for item in result if item != "")
+    return None
+
+def render_answer(answer_template, result):
+    """
+    Fills the model-provided answer template with the executed result.
+    """
+    formatted = format_result_local(result)
+    return answer_template.replace("{result}", formatted if formatted is not None else str(result))
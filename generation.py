@@ -0,0 +1,201 @@
+import asyncio
+import json
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+# Static instructions for command generation, sent as the system message so every request
+# shares a byte-identical prompt prefix
+GENERATION_INSTRUCTIONS = """
+    You are an AI assistant skilled in Kubernetes and Python. Your task is to generate a single line of Python code
+    to answer specific Kubernetes-related questions for a Minikube setup using the Kubernetes client library (v1 client).
+
+    Please carefully consider the question provided in each case. The command you generate should:
+    - Only read data (performing a read-only action) without modifying any Kubernetes resources.
+    - Store the relevant answer directly in the variable 'result' as a list or string, with no additional metadata or formatting.
+    - Avoid using any unique identifiers or unnecessary details in the response. For instance, use concise names like "mongodb" instead of "mongodb-123456".
+    - Ensure compatibility with the v1 client in Python and Minikube clusters.
+
+    For the question given by the user, generate a single line of code that:
+    - Uses the pre-defined Kubernetes client 'v1'.
+    - Answers the question concisely and directly, storing only the required information in the 'result' variable.
+
+    Reply with a JSON object and nothing else, without code fences, with two keys:
+    - "command": the single line of Python code.
+    - "answer_template": the final answer as it should be returned, with the placeholder {result} standing for the value of 'result'.
+      Keep it as short as the question allows; usually it is just "{result}".
+
+    Remember, only use read operations and return a minimal and direct answer.
+    """.strip()
+
+def build_generation_request(query):
+    """
+    Builds the chat completion request that asks GPT-4 for a Kubernetes command.
+    """
+    return {
+        "model": "gpt-4",
+        "messages": [
+            {"role": "system", "content": GENERATION_INSTRUCTIONS},
+            {"role": "user", "content": f"Question: '{query}'"}
+        ],
+        "max_tokens": 200,
+        "temperature": 0,
+    }
+
+def generation_request_query(body):
+    """
+    Recovers the query from a request built by build_generation_request.
+    """
+    content = body["messages"][-1]["content"]
+    return content[len("Question: '"):-1]
+
+# Markdown code fences that models sometimes wrap replies in, despite being asked not to
+CODE_FENCE = re.compile(r"^```(?:python|json)?\s*|\s*```$", re.MULTILINE)
+
+def strip_code_fences(text):
+    """
+    Removes Markdown code fences around a model reply.
+    """
+    return CODE_FENCE.sub("", text).strip()
+
+def parse_generation_reply(reply):
+    """
+    Splits a generation reply into (command, answer_template). Replies that are not the
+    requested JSON object are treated as a bare command without a template.
+    """
+    text = strip_code_fences(reply)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return reply, None
+
+    if not isinstance(data, dict) or not isinstance(data.get("command"), str):
+        return reply, None
+
+    answer_template = data.get("answer_template")
+    if not isinstance(answer_template, str) or "{result}" not in answer_template:
+        answer_template = None
+    return data["command"], answer_template
+
+# Instructions for answering several numbered questions in one generation call
+PACKED_GENERATION_INSTRUCTIONS = GENERATION_INSTRUCTIONS + """
+
+    You may be given several numbered questions at once. In that case reply with a single JSON object that maps
+    each question number, as a string, to the JSON object described above for that question.
+    """.rstrip()
+
+def build_packed_generation_request(queries):
+    """
+    Builds one chat completion request that generates commands for several queries.
+    """
+    numbered = "\n".join(f"{index}) {query}" for index, query in enumerate(queries, start=1))
+    return {
+        "model": "gpt-4",
+        "messages": [
+            {"role": "system", "content": PACKED_GENERATION_INSTRUCTIONS},
+            {"role": "user", "content": f"Questions:\n{numbered}"}
+        ],
+        "max_tokens": 200 * len(queries),
+        "temperature": 0,
+    }
+
+def parse_packed_reply(reply, count):
+    """
+    Splits a packed generation reply into one reply per query, in the single-query JSON
+    format. Entries that are missing or malformed come back as None; a reply that is not
+    a JSON object at all gives None.
+    """
+    try:
+        data = json.loads(strip_code_fences(reply))
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    replies = []
+    for index in range(1, count + 1):
+        item = data.get(str(index))
+        replies.append(json.dumps(item) if isinstance(item, dict) and isinstance(item.get("command"), str) else None)
+    return replies
+
+class BatchCoalescer:
+    """
+    Packs generation requests that arrive within a short window into a single GPT-4 call,
+    so bursts of queries cost one request against the rate limit instead of one each.
+
+    chat(body) returns the reply text for a chat completion request; remember(query, reply)
+    is awaited with each single-query reply once its caller has it.
+    """
+    def __init__(self, chat, remember, window=0.05, max_size=16):
+        self.chat = chat
+        self.remember = remember
+        self.window = window
+        self.max_size = max_size
+        self.queue = None
+        self.worker = None
+        # Dispatch tasks in flight; the event loop only keeps weak references to tasks
+        self.tasks = set()
+
+    async def submit(self, query):
+        """
+        Returns the generation reply for a query in the single-query JSON format.
+        """
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.ensure_future(self.run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, future))
+        return await future
+
+    def spawn(self, pending):
+        task = asyncio.ensure_future(self.dispatch(pending))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self):
+        while True:
+            pending = [await self.queue.get()]
+            await asyncio.sleep(self.window)
+            while len(pending) < self.max_size and not self.queue.empty():
+                pending.append(self.queue.get_nowait())
+            self.spawn(pending)
+
+    async def dispatch(self, pending):
+        if len(pending) == 1:
+            body = build_generation_request(pending[0][0])
+        else:
+            log.info("Packing %s queries into one generation request.", len(pending))
+            body = build_packed_generation_request([query for query, _ in pending])
+        try:
+            reply = await self.chat(body)
+        except Exception as e:
+            # API errors such as rate limits fail the whole window; resending each query on
+            # its own would only multiply the requests
+            log.error("Error generating commands for %s queries: %s", len(pending), e)
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if len(pending) == 1:
+            replies = [reply]
+        else:
+            replies = parse_packed_reply(reply, len(pending))
+            if replies is None:
+                # Usually a reply cut off at max_tokens: try each half as a smaller pack
+                log.warning("Unparsable packed reply for %s queries; splitting the pack.", len(pending))
+                middle = len(pending) // 2
+                self.spawn(pending[:middle])
+                self.spawn(pending[middle:])
+                return
+
+        for (query, future), item in zip(pending, replies):
+            if item is None:
+                # Only queries missing from a parsed packed reply are retried on their own
+                self.spawn([(query, future)])
+            elif not future.done():
+                future.set_result(item)
+        for (query, _), item in zip(pending, replies):
+            if item is not None:
+                await self.remember(query, item)
@@ -1,200 +1,517 @@
+import asyncio
+import atexit
+import functools
+import hashlib
+import json
 import logging
-from flask import Flask, request, jsonify
+import logging.handlers
+import os
+import queue
+import sys
+from quart import Quart, Response, request
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s %(levelname)s - %(message)s',
-                    filename='agent.log', filemode='a')
+# `python main.py` hands over to the uvicorn CLI before any app setup runs here, so the
+# supervisor does not build the app and each worker imports it once, after uvicorn's logging
+if __name__ == "__main__":
+    os.execvp(sys.executable, [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "0.0.0.0", "--port", "8000", "--workers", str(os.cpu_count() or 1),
+        *sys.argv[1:],
+    ])
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops records instead of blocking when the log queue is full.
+    """
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+class BatchedFileHandler(logging.handlers.MemoryHandler):
+    """
+    MemoryHandler that appends each buffered batch of records to its target file with a single write.
+    """
+    def flush(self):
+        with self.lock:
+            if self.target is None:
+                # Closed handler: drop the records instead of holding them forever
+                self.buffer.clear()
+                return
+            if not self.buffer:
+                return
+            try:
+                text = "".join(self.target.format(record) + self.target.terminator for record in self.buffer)
+                self.target.stream.write(text)
+                self.target.flush()
+            except Exception:
+                self.handleError(self.buffer[-1])
+            finally:
+                self.buffer.clear()
+
+class IdleFlushQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener that flushes its handlers whenever the queue runs dry.
+    """
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+        return self.queue.get(block)
+
+# Configure logging. Records are handed to a background thread that writes agent.log,
+# so request handlers never wait on file I/O. The thread batches records and writes
+# them out once the queue drains, on an error, or every 1024 records.
+log_queue = queue.Queue(maxsize=10000)
+file_handler = logging.FileHandler('agent.log', mode='a')
+file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s - %(message)s'))
+memory_handler = BatchedFileHandler(capacity=1024, flushLevel=logging.ERROR, target=file_handler)
+log_listener = IdleFlushQueueListener(log_queue, memory_handler)
+log_listener.start()
+atexit.register(memory_handler.flush)
+atexit.register(log_listener.stop)
+logging.basicConfig(level=logging.DEBUG, format='%(message)s', handlers=[DroppingQueueHandler(log_queue)])
+log = logging.getLogger(__name__)
 
 # Check for and import each required module, logging any errors
 missing_modules = []
 
-# Try importing each library with exception handling
+# Try importing each library with exception handling. ijson and kubernetes are used by
+# dispatch.py and bootstrap.py; they are imported here only to report them up front.
 try:
-    from pydantic import BaseModel, ValidationError
+    import ijson  # noqa: F401
 except ImportError:
-    missing_modules.append("pydantic")
+    missing_modules.append("ijson")
 
 try:
-    from kubernetes import client, config
+    import orjson
+except ImportError:
+    missing_modules.append("orjson")
+
+try:
+    import kubernetes  # noqa: F401
 except ImportError:
     missing_modules.append("kubernetes")
 
 try:
-    import openai
-    openai.api_key = os.getenv("OPENAI_API_KEY")
+    import httpx
+except ImportError:
+    missing_modules.append("httpx")
+
+try:
+    from openai import AsyncOpenAI
 except ImportError:
     missing_modules.append("openai")
 
+try:
+    import redis.asyncio as redis
+    from redis.exceptions import RedisError
+except ImportError:
+    missing_modules.append("redis")
+
 # If there are missing modules, log and notify the user
 if missing_modules:
     missing_message = f"Missing required modules: {', '.join(missing_modules)}"
-    logging.error(missing_message)
+    log.error(missing_message)
     raise ImportError(missing_message)
 
+import batch
+from bootstrap import get_v1
+from dispatch import kube_names, looks_like_command, plan_command, run_plan
+from formatting import format_result_local, is_empty_result, render_answer
+from generation import (
+    BatchCoalescer, build_generation_request, generation_request_query, parse_generation_reply, strip_code_fences,
+)
+
+# Resolved once per process; the app does not start without it
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+if not OPENAI_API_KEY:
+    log.error("OPENAI_API_KEY is not set.")
+    raise RuntimeError("OPENAI_API_KEY is not set")
+
 # Continue with the rest of the application setup
-app = Flask(__name__)
+app = Quart(__name__)
+
+# Shared async OpenAI client, reused across requests. It runs over HTTP/2 with a pool of
+# keep-alive connections so calls skip the TCP and TLS handshakes.
+aclient = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+        timeout=30,
+    ),
+)
+
+# Response cache in front of OpenAI; requests still go through when Redis is unavailable
+cache = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), socket_connect_timeout=0.5)
+CACHE_TTL = 3600
+
+# Local kubectl-generation model served by Ollama, e.g. http://localhost:11434/api/generate;
+# disabled unless LOCAL_MODEL_URL is set
+LOCAL_MODEL_URL = os.getenv("LOCAL_MODEL_URL", "")
+LOCAL_MODEL = os.getenv("LOCAL_MODEL", "kubectl_operator")
+local_client = httpx.AsyncClient(timeout=10)
+
+# Pipelines currently running in this worker, keyed by query hash
+inflight_queries = {}
+
+# Optional services (Redis, the local model) already reported as unavailable
+reported_unavailable = set()
+
+def report_unavailable(service, error):
+    """
+    Logs that an optional service is unavailable: a warning the first time, then DEBUG, so a
+    deployment without it neither floods agent.log nor forces a flush on every request.
+    """
+    level = logging.DEBUG if service in reported_unavailable else logging.WARNING
+    reported_unavailable.add(service)
+    log.log(level, "%s unavailable: %s", service, error)
 
-# Load Kubernetes configuration
+# Load Kubernetes configuration up front; get_v1() tries again on later calls if this fails
 try:
-    config.load_kube_config(config_file="~/.kube/config")
-    v1 = client.CoreV1Api()
-    logging.info("Kubernetes configuration loaded successfully.")
+    get_v1()
 except Exception as e:
-    logging.error(f"Failed to load Kubernetes configuration: {str(e)}")
-    v1 = None
+    log.error("Failed to load Kubernetes configuration: %s", e)
 
-# Define the response model
-class QueryResponse(BaseModel):
-    query: str
-    answer: str
+def response_cache_key(body):
+    """
+    Returns the Redis key for a chat completion request.
+    """
+    return "response:" + hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
 
-def generate_kubernetes_command(query):
+async def cache_get(key):
     """
-    Generates a Kubernetes command for a given query using GPT-4.
+    Returns the cached reply for a key, or None on a miss or when Redis is unavailable.
     """
-    prompt = f"""
-    You are an AI assistant skilled in Kubernetes and Python. Your task is to generate a single line of Python code
-    to answer specific Kubernetes-related questions for a Minikube setup using the Kubernetes client library (v1 client).
+    try:
+        cached = await cache.get(key)
+    except RedisError as e:
+        report_unavailable("Response cache", e)
+        return None
+    if cached is None:
+        return None
+    log.debug("Cache hit for %s", key)
+    return cached.decode()
 
-    Please carefully consider the question provided in each case. The command you generate should:
-    - Only read data (performing a read-only action) without modifying any Kubernetes resources.
-    - Store the relevant answer directly in the variable 'result' as a list or string, with no additional metadata or formatting.
-    - Avoid using any unique identifiers or unnecessary details in the response. For instance, use concise names like "mongodb" instead of "mongodb-123456".
-    - Ensure compatibility with the v1 client in Python and Minikube clusters. 
+async def cache_set(key, reply):
+    """
+    Stores a reply for CACHE_TTL seconds, logging and ignoring Redis errors.
+    """
+    try:
+        await cache.setex(key, CACHE_TTL, reply)
+    except RedisError as e:
+        report_unavailable("Response cache", e)
 
-    Given the question: '{query}', generate a single line of code that:
-    - Uses the pre-defined Kubernetes client 'v1'.
-    - Answers the question concisely and directly, storing only the required information in the 'result' variable.
-    - Does not include any code fences, such as ```python or ```.
+async def uncached_chat(body):
+    """
+    Returns the reply text for a chat completion request.
+    """
+    response = await aclient.chat.completions.create(**body)
+    return response.choices[0].message.content.strip()
 
-    Remember, only use read operations and return a minimal and direct answer.
+async def cached_chat(**body):
+    """
+    Returns the reply text for a chat completion request, serving repeated requests from Redis.
     """
+    key = response_cache_key(body)
+    reply = await cache_get(key)
+    if reply is None:
+        reply = await uncached_chat(body)
+        await cache_set(key, reply)
+    return reply
 
-    logging.info(f"Prompt for command generation: {prompt.strip()}")
+# Instruction for the local model; the question is appended to it
+LOCAL_INSTRUCTION_PREFIX = (
+    "Write a single line of read-only Python code that uses the pre-defined Kubernetes client 'v1' "
+    "and stores the answer to the following question in the variable 'result': "
+)
+
+async def generate_command_locally(query):
+    """
+    Asks the local kubectl-generation model for a command. Returns None when the model is
+    not configured, unreachable, or replies with something that does not look like a command.
+    """
+    if not LOCAL_MODEL_URL:
+        return None
+
+    instruction = LOCAL_INSTRUCTION_PREFIX + query
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an AI assistant skilled in Kubernetes and Python. Generate minimal, read-only code for specific queries on a Minikube cluster using the v1 client."},
-                {"role": "user", "content": prompt.strip()}
-            ],
-            max_tokens=150,
-            temperature=0.3,
-        )
-        command = response.choices[0].message['content'].strip()
-        logging.info(f"Generated command: {command}")
-        return command
+        response = await local_client.post(LOCAL_MODEL_URL, json={
+            "model": LOCAL_MODEL,
+            "prompt": instruction,
+            "options": {"temperature": 0.3},
+            "stream": False,
+        })
+        response.raise_for_status()
+        command = strip_code_fences(response.json().get("response", ""))
     except Exception as e:
-        logging.error(f"Error generating Kubernetes command: {str(e)}")
+        report_unavailable("Local model", e)
         return None
 
+    if not looks_like_command(command):
+        log.info("Discarding local model output: %s", command)
+        return None
+    return command
+
+async def remember_generation(query, reply):
+    """
+    Caches a generation reply under the query's single-query request, which
+    generate_kubernetes_command checks before submitting to the coalescer.
+    """
+    await cache_set(response_cache_key(build_generation_request(query)), reply)
+
+generation_coalescer = BatchCoalescer(uncached_chat, remember_generation)
+
+async def generate_kubernetes_command(query):
+    """
+    Generates a Kubernetes command and an answer template for a given query. The local
+    model is tried first; GPT-4 is used when it is unavailable or its output is unusable.
+    """
+    command = await generate_command_locally(query)
+    if command:
+        log.info("Generated command locally: %s", command)
+        return command, None
+
+    log.info("Requesting command generation for: %s", query)
+    try:
+        # Cached replies are returned straight away instead of waiting for the coalescing window
+        reply = await cache_get(response_cache_key(build_generation_request(query)))
+        if reply is None:
+            reply = await generation_coalescer.submit(query)
+        command, answer_template = parse_generation_reply(reply)
+        log.info("Generated command: %s, answer template: %s", command, answer_template)
+        return command, answer_template
+    except Exception as e:
+        log.error("Error generating Kubernetes command: %s", e)
+        return None, None
+
+@functools.lru_cache(maxsize=256)
+def compile_command(command):
+    """
+    Compiles a generated command that the dispatcher does not recognize but that passed
+    looks_like_command.
+    """
+    return compile(command, "<generated>", "exec")
+
 def execute_generated_command(command):
     """
     Executes the generated Kubernetes command and returns the result.
     """
     if not command:
-        logging.error("No command to execute.")
+        log.error("No command to execute.")
         return "No command generated."
 
-    local_vars = {}
-    command = command.replace("```python", "").replace("```", "").strip()
-    logging.debug(f"Executing command: {command}")
+    command = strip_code_fences(command)
+    log.debug("Executing command: %s", command)
 
     try:
-        exec(command, globals(), local_vars)
-        result = local_vars.get('result', "No result returned")
-        logging.debug(f"Execution result: {result}")
+        plan = plan_command(command)
+        if plan:
+            log.debug("Dispatching command as %s", plan)
+            result = run_plan(plan)
+        elif not looks_like_command(command):
+            # Commands from every source, not just the local model, must stay on read calls
+            log.warning("Refusing to execute command: %s", command)
+            return "Error: the generated command is not a read-only Kubernetes query."
+        else:
+            local_vars = {}
+            exec(compile_command(command), {"v1": get_v1()}, local_vars)
+            result = local_vars.get('result', "No result returned")
+        log.debug("Execution result: %s", result)
         return result
     except AttributeError as e:
-        logging.error(f"Attribute error during command execution: {str(e)}")
+        log.error("Attribute error during command execution: %s", e)
         return "Kubernetes client method not supported on Minikube."
     except Exception as e:
-        logging.error(f"Execution error: {str(e)}")
+        log.error("Execution error: %s", e)
         return f"Error executing command: {str(e)}"
 
-def format_result_with_gpt(query, result):
-    """
-    Formats the raw result into a concise answer.
-    """
-    prompt = f"""
-    You are an AI assistant skilled in summarizing technical data. Given the question: '{query}' and the raw result: '{result}',
+# Summarizing a result is a small task, so the formatting fallback uses a cheaper model
+FORMATTING_MODEL = "gpt-4o-mini"
+
+# Static instructions for the GPT formatting fallback
+FORMATTING_INSTRUCTIONS = """
+    You are an AI assistant skilled in summarizing technical data. Given a question and the raw result that answers it,
     provide only the direct answer without any metadata, unique identifiers, or extra formatting. For example, return 'mongodb' instead of 'mongodb-56c598c8fc'.
     Return only the concise and relevant answer that directly addresses the question.
+    """.strip()
+
+def build_formatting_request(query, result):
+    """
+    Builds the chat completion request that condenses a raw result into an answer.
     """
+    return {
+        "model": FORMATTING_MODEL,
+        "messages": [
+            {"role": "system", "content": FORMATTING_INSTRUCTIONS},
+            {"role": "user", "content": f"Question: '{query}'\nRaw result: '{result}'"}
+        ],
+        "max_tokens": 16,
+        "temperature": 0,
+    }
 
-    logging.debug(f"Prompt for result formatting: {prompt.strip()}")
+async def format_result_with_gpt(query, result):
+    """
+    Formats the raw result into a concise answer.
+    """
+    body = build_formatting_request(query, result)
+    log.debug("Prompt for result formatting: %s", body["messages"][-1]["content"])
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an AI assistant skilled in summarizing technical data concisely, without extra identifiers."},
-                {"role": "user", "content": prompt.strip()}
-            ],
-            max_tokens=20,
-            temperature=0.3,
-        )
-        answer = response.choices[0].message['content'].strip()
-        logging.debug(f"Formatted answer: {answer}")
+        answer = await cached_chat(**body)
+        log.debug("Formatted answer: %s", answer)
         return answer
     except Exception as e:
-        logging.error(f"Error formatting result with GPT: {str(e)}")
+        log.error("Error formatting result with GPT: %s", e)
         return "Error formatting answer."
 
+async def finish_answer(query, raw_result, answer_template):
+    """
+    Turns an executed result into the final answer. Results are formatted locally, using
+    the generation step's template when there is one; only results that need summarizing
+    go to the GPT formatter, as do empty results, which a template would render as "[]".
+    """
+    if answer_template and not is_empty_result(raw_result):
+        answer = render_answer(answer_template, raw_result)
+        log.debug("Rendered answer: %s", answer)
+        return answer
+
+    answer = format_result_local(raw_result)
+    if answer is not None:
+        log.debug("Formatted answer locally: %s", answer)
+        return answer
+    return await format_result_with_gpt(query, raw_result)
+
+def json_response(payload, status=200):
+    """
+    Serializes a response payload with orjson.
+    """
+    return Response(orjson.dumps(payload), status=status, mimetype="application/json")
+
+async def answer_query(query):
+    """
+    Runs the generate/execute/format pipeline for a query and returns (payload, status).
+    """
+    # Step 1: Generate Kubernetes command
+    command, answer_template = await generate_kubernetes_command(query)
+    if not command:
+        log.error("Failed to generate command.")
+        return {"error": "Failed to generate command"}, 500
+
+    # Step 2: Execute the command off the event loop (the Kubernetes client is blocking)
+    raw_result = await asyncio.to_thread(execute_generated_command, command)
+    if isinstance(raw_result, str) and "Error" in raw_result:
+        log.error("Error in command execution.")
+        return {"error": raw_result}, 500
+
+    # Step 3: Format the result
+    answer = await finish_answer(query, raw_result, answer_template)
+    if "Error" in answer:
+        log.error("Error in formatting result.")
+        return {"error": answer}, 500
+
+    return {"query": query, "answer": answer}, 200
+
+async def answer_query_once(query):
+    """
+    Answers a query, letting concurrent requests for the same query share one pipeline run.
+    """
+    key = hashlib.sha1(query.encode()).hexdigest()
+    task = inflight_queries.get(key)
+    if task is None:
+        task = asyncio.ensure_future(answer_query(query))
+        inflight_queries[key] = task
+        task.add_done_callback(lambda _: inflight_queries.pop(key, None))
+    else:
+        log.info("Joining in-flight query: %s", query)
+    # Shield the shared task so one client disconnecting does not cancel it for the others
+    return await asyncio.shield(task)
+
 @app.route('/query', methods=['POST'])
-def create_query():
+async def create_query():
     try:
-        request_data = request.json
+        request_data = await request.get_json()
         query = request_data.get('query')
 
         if not query:
-            logging.error("No query provided in request.")
-            return jsonify({"error": "No query provided"}), 400
-
-        logging.info(f"Received query: {query}")
-
-        # Step 1: Generate Kubernetes command
-        command = generate_kubernetes_command(query)
-        if not command:
-            logging.error("Failed to generate command.")
-            return jsonify({"error": "Failed to generate command"}), 500
-
-        # Step 2: Execute the command
-        raw_result = execute_generated_command(command)
-        if "Error" in raw_result:
-            logging.error("Error in command execution.")
-            return jsonify({"error": raw_result}), 500
-
-        # Step 3: Format the result
-        answer = format_result_with_gpt(query, raw_result)
-        if "Error" in answer:
-            logging.error("Error in formatting result.")
-            return jsonify({"error": answer}), 500
-
-        response = QueryResponse(query=query, answer=answer)
-        return jsonify(response.dict())
-    
-    except ValidationError as e:
-        logging.error(f"Validation Error: {e.errors()}")
-        return jsonify({"error": e.errors()}), 400
+            log.error("No query provided in request.")
+            return json_response({"error": "No query provided"}, 400)
+
+        log.info("Received query: %s", query)
+
+        payload, status = await answer_query_once(query)
+        return json_response(payload, status)
+
+    except Exception as e:
+        log.error("Error processing query: %s", e)
+        return json_response({"error": str(e)}, 500)
+
+@app.route('/query_batch', methods=['POST'])
+async def create_query_batch():
+    """
+    Submits a list of queries through the OpenAI Batch API for offline processing.
+    """
+    try:
+        request_data = await request.get_json(silent=True)
+        queries = request_data.get('queries') if isinstance(request_data, dict) else None
+
+        if not isinstance(queries, list) or not queries or not all(isinstance(query, str) and query for query in queries):
+            log.error("No queries provided in batch request.")
+            return json_response({"error": "No queries provided"}, 400)
+
+        batch_id = await batch.submit_batch(aclient, queries, build_generation_request)
+        return json_response({"batch_id": batch_id, "status": "submitted"}, 202)
+
     except Exception as e:
-        logging.error(f"Error processing query: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        log.error("Error submitting batch: %s", e)
+        return json_response({"error": str(e)}, 500)
+
+@app.route('/batch_result/<batch_id>', methods=['GET'])
+async def get_batch_result(batch_id):
+    """
+    Polls a submitted batch. Once the generated commands are available they are
+    executed against the live cluster and their answers rendered.
+    """
+    try:
+        status, queries, replies = await batch.collect_batch(aclient, batch_id, generation_request_query)
+
+        if status in batch.PENDING_STATUSES:
+            return json_response({"batch_id": batch_id, "status": status}, 202)
+        if status == batch.COLLECTED_STATUS:
+            return json_response({"batch_id": batch_id, "status": status, "error": "Batch results were already collected"}, 410)
+        if status != "completed":
+            log.error("Batch %s ended with status %s.", batch_id, status)
+            return json_response({"batch_id": batch_id, "status": status, "error": f"Batch {status}"}, 500)
+
+        generated = [parse_generation_reply(reply) if reply else (None, None) for reply in replies]
+        raw_results = await asyncio.gather(
+            *(asyncio.to_thread(execute_generated_command, command) for command, _ in generated)
+        )
+        answers = await asyncio.gather(
+            *(finish_answer(query, raw_result, answer_template)
+              for query, raw_result, (_, answer_template) in zip(queries, raw_results, generated))
+        )
+        results = [{"query": query, "answer": answer} for query, answer in zip(queries, answers)]
+        return json_response({"batch_id": batch_id, "status": status, "results": results})
+
+    except Exception as e:
+        log.error("Error collecting batch %s: %s", batch_id, e)
+        return json_response({"error": str(e)}, 500)
 
 # Minimal debug route to ensure Kubernetes connectivity remains functional
 @app.route('/test_kube_connection', methods=['GET'])
-def test_kube_connection():
-    if not v1:
-        logging.error("Kubernetes client not initialized.")
-        return jsonify({"error": "Kubernetes client not initialized"}), 500
-
+async def test_kube_connection():
     try:
-        namespaces = [ns.metadata.name for ns in v1.list_namespace().items]
-        logging.info("Kubernetes connection successful.")
-        return jsonify({"namespaces": namespaces})
+        await asyncio.to_thread(get_v1)
     except Exception as e:
-        logging.error(f"Kubernetes connection failed: {e}")
-        return jsonify({"error": str(e)}), 500
+        log.error("Kubernetes client not initialized: %s", e)
+        return json_response({"error": "Kubernetes client not initialized"}, 500)
 
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, threaded=False)
+    try:
+        namespaces = await asyncio.to_thread(kube_names, "namespace")
+        log.info("Kubernetes connection successful.")
+        return json_response({"namespaces": namespaces})
+    except Exception as e:
+        log.error("Kubernetes connection failed: %s", e)
+        return json_response({"error": str(e)}, 500)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+openai = pytest.importorskip("openai")
+
+import batch
+from generation import build_generation_request, generation_request_query
+
+
+def not_found(file_id):
+    request = httpx.Request("GET", f"https://api.openai.com/v1/files/{file_id}/content")
+    return openai.NotFoundError("No such file", response=httpx.Response(404, request=request), body=None)
+
+
+class FakeFiles:
+    def __init__(self):
+        self.contents = {}
+        self.deleted = []
+
+    async def create(self, file, purpose):
+        file_id = f"file-{len(self.contents)}"
+        self.contents[file_id] = file[1].decode()
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    async def content(self, file_id):
+        if file_id not in self.contents:
+            raise not_found(file_id)
+        return SimpleNamespace(text=self.contents[file_id])
+
+    async def delete(self, file_id):
+        if file_id not in self.contents:
+            raise not_found(file_id)
+        del self.contents[file_id]
+        self.deleted.append(file_id)
+
+
+class FakeBatches:
+    def __init__(self, files):
+        self.files = files
+        self.batches = {}
+        self.error = None
+
+    async def create(self, input_file_id, endpoint, completion_window):
+        if self.error:
+            raise self.error
+        batch_id = f"batch-{len(self.batches)}"
+        self.batches[batch_id] = SimpleNamespace(
+            id=batch_id, status="validating", input_file_id=input_file_id, output_file_id=None, error_file_id=None)
+        return self.batches[batch_id]
+
+    async def retrieve(self, batch_id):
+        return self.batches[batch_id]
+
+    def complete(self, batch_id, replies):
+        """
+        Finishes a batch, answering request i with replies[i], or failing it when that is None.
+        """
+        lines = []
+        for index, reply in enumerate(replies):
+            if reply is None:
+                lines.append({"custom_id": str(index), "response": {"status_code": 500}, "error": {"message": "boom"}})
+            else:
+                body = {"choices": [{"message": {"content": f" {reply} "}}]}
+                lines.append({"custom_id": str(index), "response": {"status_code": 200, "body": body}})
+        output_file_id = f"file-{len(self.files.contents)}"
+        self.files.contents[output_file_id] = "\n".join(json.dumps(line) for line in lines)
+        current = self.batches[batch_id]
+        current.status = "completed"
+        current.output_file_id = output_file_id
+
+
+@pytest.fixture
+def aclient():
+    files = FakeFiles()
+    return SimpleNamespace(files=files, batches=FakeBatches(files))
+
+
+def test_submit_batch_uploads_one_request_per_query(aclient):
+    batch_id = asyncio.run(batch.submit_batch(aclient, ["a", "b"], build_generation_request))
+
+    assert batch_id == "batch-0"
+    (contents,) = aclient.files.contents.values()
+    lines = [json.loads(line) for line in contents.splitlines()]
+    assert [line["custom_id"] for line in lines] == ["0", "1"]
+    assert [line["body"] for line in lines] == [build_generation_request("a"), build_generation_request("b")]
+    assert all(line["url"] == batch.BATCH_ENDPOINT for line in lines)
+
+
+def test_submit_batch_deletes_input_when_create_fails(aclient):
+    aclient.batches.error = not_found("batches")
+    with pytest.raises(openai.NotFoundError):
+        asyncio.run(batch.submit_batch(aclient, ["a"], build_generation_request))
+    assert aclient.files.contents == {}
+
+
+def test_collect_batch_pending(aclient):
+    batch_id = asyncio.run(batch.submit_batch(aclient, ["a"], build_generation_request))
+    assert asyncio.run(batch.collect_batch(aclient, batch_id, generation_request_query)) == ("validating", None, None)
+    assert aclient.files.deleted == []
+
+
+def test_collect_batch_rebuilds_queries_and_deletes_files(aclient):
+    queries = ["How many pods?", "Which namespace is 'web' in?", "Is it up?"]
+    batch_id = asyncio.run(batch.submit_batch(aclient, queries, build_generation_request))
+    aclient.batches.complete(batch_id, ["first", None, "third"])
+
+    status, collected, replies = asyncio.run(batch.collect_batch(aclient, batch_id, generation_request_query))
+
+    assert status == "completed"
+    assert collected == queries
+    assert replies == ["first", None, "third"]
+    assert aclient.files.contents == {}
+
+    assert asyncio.run(batch.collect_batch(aclient, batch_id, generation_request_query)) == (
+        batch.COLLECTED_STATUS, None, None)
+
+
+def test_collect_batch_failed(aclient):
+    batch_id = asyncio.run(batch.submit_batch(aclient, ["a"], build_generation_request))
+    aclient.batches.batches[batch_id].status = "failed"
+
+    assert asyncio.run(batch.collect_batch(aclient, batch_id, generation_request_query)) == ("failed", None, None)
+    assert aclient.files.contents == {}
@@ -0,0 +1,209 @@
+import io
+import json
+
+import pytest
+
+pytest.importorskip("ijson")
+pytest.importorskip("kubernetes")
+
+import dispatch
+from dispatch import (
+    CommandPlan, fetch_raw_page, kube_names, looks_like_command, plan_command, run_plan, run_raw_plan,
+    scope_to_namespace,
+)
+
+
+class Page(io.BytesIO):
+    """
+    Stands in for the urllib3 response returned with _preload_content=False.
+    """
+    released = False
+
+    def release_conn(self):
+        self.released = True
+
+
+class FakeCoreV1Api:
+    """
+    Serves every list call from one list of items, paginated the way the API server does.
+    """
+    def __init__(self, items, report_remaining=True):
+        self.items = items
+        self.report_remaining = report_remaining
+        self.calls = []
+        self.pages = []
+
+    def __getattr__(self, method):
+        def list_call(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            start = int(kwargs.get("_continue", 0))
+            end = start + kwargs["limit"]
+            metadata = {"resourceVersion": "1"}
+            if end < len(self.items):
+                metadata["continue"] = str(end)
+                if self.report_remaining:
+                    metadata["remainingItemCount"] = len(self.items) - end
+            page = Page(json.dumps({"kind": "List", "metadata": metadata, "items": self.items[start:end]}).encode())
+            self.pages.append(page)
+            return page
+        return list_call
+
+
+def pod(name, namespace="default", phase="Running", labels=None):
+    return {
+        "metadata": {"name": name, "namespace": namespace, "labels": labels or {}},
+        "status": {"phase": phase, "conditions": [{"type": "Ready", "status": "True"}]},
+    }
+
+
+@pytest.fixture
+def v1(monkeypatch):
+    api = FakeCoreV1Api([pod(f"web-{index}", phase="Pending" if index % 3 == 0 else "Running") for index in range(5)])
+    monkeypatch.setattr(dispatch, "get_v1", lambda: api)
+    monkeypatch.setattr(dispatch, "LIST_PAGE_SIZE", 2)
+    dispatch.plan_results.clear()
+    yield api
+    dispatch.plan_results.clear()
+
+
+def test_plan_call():
+    assert plan_command("result = v1.read_namespace('default').status.phase") == CommandPlan(
+        "read_namespace", ("default",), (), "call", ("status", "phase"), ())
+
+
+def test_plan_items():
+    plan = plan_command("result = [p.metadata.name for p in v1.list_namespaced_pod(namespace='test').items]")
+    assert plan == CommandPlan(
+        "list_namespaced_pod", (), (("namespace", "test"),), "items", ("metadata", "name"), ())
+
+
+def test_plan_count():
+    assert plan_command("result = len(v1.list_namespace().items)") == CommandPlan(
+        "list_namespace", (), (), "count", (), ())
+
+
+def test_plan_filtered_count():
+    plan = plan_command(
+        "result = len([p for p in v1.list_namespaced_pod('test').items if p.status.phase == 'Running'])")
+    assert plan == CommandPlan(
+        "list_namespaced_pod", ("test",), (), "count", (), ((("status", "phase"), "Running"),))
+
+
+def test_plan_scopes_namespace_filter():
+    plan = plan_command(
+        "result = [p.metadata.name for p in v1.list_pod_for_all_namespaces().items"
+        " if p.metadata.namespace == 'test' if p.status.phase == 'Running']")
+    assert plan == CommandPlan(
+        "list_namespaced_pod", (), (("namespace", "test"),), "items", ("metadata", "name"),
+        ((("status", "phase"), "Running"),))
+
+
+@pytest.mark.parametrize("command", [
+    "result = v1.delete_namespace('test')",
+    "result = v1.list_namespaced_pod(namespace)",
+    "result = v1.list_namespaced_pod(**options).items",
+    "result = [p.metadata.name for p in v1.list_namespace().items if p.metadata.name != 'default']",
+    "value = v1.list_namespace()",
+    "result = v1.list_namespace(",
+    "result = len(v1.list_namespace(watch=True).items)",
+    "result = v1.list_namespace().__class__",
+])
+def test_plan_rejects(command):
+    assert plan_command(command) is None
+
+
+@pytest.mark.parametrize("command", [
+    "result = v1.read_namespace('default').status.phase",
+    "result = len(v1.list_namespace().items)",
+    "result = sorted(n.metadata.name for n in v1.list_namespace().items)",
+    "result = [p.metadata.name for p in v1.list_pod_for_all_namespaces().items if p.status.phase != 'Running']",
+])
+def test_looks_like_command_accepts(command):
+    assert looks_like_command(command)
+
+
+@pytest.mark.parametrize("command", [
+    "",
+    "result = v1.delete_namespaced_pod('web', 'default')",
+    "result = v1.read_namespace('x').metadata.name; [x for x in iter(int, 1)]",
+    "result = v1.read_namespace('x')\nresult = v1.delete_namespace('x')",
+    "result = v1.list_namespace(watch=True)",
+    "result = v1.list_namespace(_preload_content=False).data",
+    "result = v1.list_namespace(**{'watch': True})",
+    "c = v1; result = c.delete_namespace('x')",
+    "result = (lambda c: c.delete_namespace('x'))(v1)",
+    "result = getattr(v1, 'delete_namespace')('x')",
+    "result = v1.list_namespace().__class__",
+    "result = __import__('os').system('true') or v1.list_namespace()",
+    "result = v1.list_namespace(",
+    "v1.list_namespace()",
+])
+def test_looks_like_command_rejects(command):
+    assert not looks_like_command(command)
+
+
+def test_scope_to_namespace_keeps_other_lists():
+    plan = CommandPlan("list_namespace", (), (), "items", ("metadata", "name"), ((("metadata", "namespace"), "test"),))
+    assert scope_to_namespace(plan) is plan
+
+
+def test_fetch_raw_page_rebuilds_nested_fields(v1):
+    v1.items = [pod("web", labels={"app": "web", "tier": "front"}), pod("db")]
+    fields = [("metadata", "name"), ("metadata", "labels"), ("status", "conditions"), ("spec", "nodeName")]
+    rows, token, remaining = fetch_raw_page("list_namespaced_pod", ("default",), (), fields, 10, None)
+
+    assert rows == [
+        {("metadata", "name"): "web", ("metadata", "labels"): {"app": "web", "tier": "front"},
+         ("status", "conditions"): [{"type": "Ready", "status": "True"}]},
+        {("metadata", "name"): "db", ("metadata", "labels"): {},
+         ("status", "conditions"): [{"type": "Ready", "status": "True"}]},
+    ]
+    assert (token, remaining) == (None, None)
+    assert v1.calls == [("list_namespaced_pod", ("default",), {"limit": 10, "_preload_content": False})]
+    assert v1.pages[0].released
+
+
+def test_fetch_raw_page_continues(v1):
+    rows, token, remaining = fetch_raw_page("list_namespace", (), (), [("metadata", "name")], 2, "2")
+
+    assert rows == [{("metadata", "name"): "web-2"}, {("metadata", "name"): "web-3"}]
+    assert (token, remaining) == ("4", 1)
+    assert v1.calls[0][2]["_continue"] == "2"
+
+
+def test_run_raw_plan_follows_pages(v1):
+    plan = plan_command("result = [p.metadata.name for p in v1.list_namespaced_pod('default').items]")
+    assert run_raw_plan(plan) == [f"web-{index}" for index in range(5)]
+    assert [kwargs.get("_continue") for _, _, kwargs in v1.calls] == [None, "2", "4"]
+
+
+def test_run_raw_plan_filters(v1):
+    plan = plan_command(
+        "result = [p.metadata.name for p in v1.list_namespaced_pod('default').items if p.status.phase == 'Pending']")
+    assert run_raw_plan(plan) == ["web-0", "web-3"]
+
+    plan = plan._replace(shape="count", path=())
+    assert run_raw_plan(plan) == 2
+
+
+def test_count_uses_remaining_item_count(v1):
+    assert run_raw_plan(plan_command("result = len(v1.list_namespace().items)")) == 5
+    assert [kwargs["limit"] for _, _, kwargs in v1.calls] == [1]
+
+
+def test_count_without_remaining_item_count(v1):
+    v1.report_remaining = False
+    assert run_raw_plan(plan_command("result = len(v1.list_namespace().items)")) == 5
+    assert [kwargs["limit"] for _, _, kwargs in v1.calls] == [1, 2, 2, 2]
+
+
+def test_run_plan_reuses_recent_results(v1):
+    plan = plan_command("result = len(v1.list_namespace().items)")
+    assert run_plan(plan) == run_plan(plan) == 5
+    assert len(v1.calls) == 1
+
+
+def test_kube_names(v1):
+    assert kube_names("pod", namespace="test") == [f"web-{index}" for index in range(5)]
+    assert v1.calls[0][0] == "list_namespaced_pod"
+    assert v1.calls[0][2]["namespace"] == "test"
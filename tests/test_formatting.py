@@ -0,0 +1,34 @@
+import pytest
+
+from formatting import format_result_local, is_empty_result, render_answer
+
+
+@pytest.mark.parametrize("result, expected", [
+    ("mongodb-56c598c8fc", "mongodb"),
+    ("web-56c598c8fc-x7k2p", "web"),
+    ("redis-0", "redis-0"),
+    ("default", "default"),
+    (3, "3"),
+    (True, "True"),
+    (["kube-system", "web-56c598c8fc-x7k2p"], "kube-system, web"),
+    (("a", "", "b"), "a, b"),
+    ([1, 2.5], "1, 2.5"),
+])
+def test_format_result_local(result, expected):
+    assert format_result_local(result) == expected
+
+
+@pytest.mark.parametrize("result", ["", [], (), set(), [""], {"app": "web"}, [{"name": "web"}], None])
+def test_format_result_local_leaves_summarizing_to_gpt(result):
+    assert format_result_local(result) is None
+
+
+@pytest.mark.parametrize("result, empty", [("", True), ([], True), (["", ""], True), (["a", ""], False), (0, False)])
+def test_is_empty_result(result, empty):
+    assert is_empty_result(result) is empty
+
+
+def test_render_answer():
+    assert render_answer("There are {result} pods.", 4) == "There are 4 pods."
+    assert render_answer("Running: {result}", ["web-56c598c8fc-x7k2p", ""]) == "Running: web"
+    assert render_answer("Labels: {result}", {"app": "web"}) == "Labels: {'app': 'web'}"
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+import pytest
+
+from generation import (
+    BatchCoalescer, build_generation_request, generation_request_query, parse_generation_reply, parse_packed_reply,
+)
+
+
+def generation(command):
+    return {"command": command, "answer_template": "{result}"}
+
+
+def test_parse_generation_reply():
+    reply = '```json\n{"command": "result = 1", "answer_template": "There is {result}."}\n```'
+    assert parse_generation_reply(reply) == ("result = 1", "There is {result}.")
+    assert parse_generation_reply('{"command": "result = 1", "answer_template": "one"}') == ("result = 1", None)
+    assert parse_generation_reply("result = 1") == ("result = 1", None)
+
+
+def test_generation_request_query():
+    query = "Which namespace is 'web' in?"
+    assert generation_request_query(build_generation_request(query)) == query
+
+
+def test_parse_packed_reply():
+    reply = json.dumps({"1": generation("result = 1"), "3": {"answer_template": "{result}"}})
+    assert parse_packed_reply(reply, 3) == [json.dumps(generation("result = 1")), None, None]
+
+
+@pytest.mark.parametrize("reply", ['{"1": {"command": "result = 1"', "[]", "result = 1"])
+def test_parse_packed_reply_rejects_unparsable(reply):
+    assert parse_packed_reply(reply, 2) is None
+
+
+class FakeChat:
+    """
+    Answers packed requests with one generation per question, except for the questions in
+    `skip`, and single requests with a plain generation. Replies can be overridden in order.
+    """
+    def __init__(self, replies=(), skip=()):
+        self.replies = list(replies)
+        self.skip = set(skip)
+        self.bodies = []
+
+    async def __call__(self, body):
+        self.bodies.append(body)
+        if self.replies:
+            reply = self.replies.pop(0)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+        content = body["messages"][-1]["content"]
+        if not content.startswith("Questions:"):
+            return json.dumps(generation("single"))
+        questions = content.splitlines()[1:]
+        return json.dumps({
+            str(index): generation(question.split(") ", 1)[1])
+            for index, question in enumerate(questions, start=1) if question.split(") ", 1)[1] not in self.skip
+        })
+
+
+def coalesce(chat, queries, window=0.01):
+    remembered = {}
+
+    async def remember(query, reply):
+        remembered[query] = reply
+
+    async def main():
+        coalescer = BatchCoalescer(chat, remember, window=window)
+        results = await asyncio.gather(*(coalescer.submit(query) for query in queries), return_exceptions=True)
+        # Let caching and retries finish
+        while coalescer.tasks:
+            await asyncio.sleep(0)
+        return results
+
+    return asyncio.run(main()), remembered
+
+
+def test_coalescer_packs_one_window():
+    chat = FakeChat()
+    results, remembered = coalesce(chat, ["a", "b", "c"])
+
+    assert [json.loads(result)["command"] for result in results] == ["a", "b", "c"]
+    assert len(chat.bodies) == 1
+    assert set(remembered) == {"a", "b", "c"}
+
+
+def test_coalescer_sends_single_query_alone():
+    chat = FakeChat()
+    results, remembered = coalesce(chat, ["a"])
+
+    assert json.loads(results[0])["command"] == "single"
+    assert chat.bodies[0]["messages"][-1]["content"] == "Question: 'a'"
+    assert remembered == {"a": results[0]}
+
+
+def test_coalescer_retries_only_missing_entries():
+    chat = FakeChat(skip={"b"})
+    results, _ = coalesce(chat, ["a", "b", "c"])
+
+    assert [json.loads(result)["command"] for result in results] == ["a", "single", "c"]
+    assert len(chat.bodies) == 2
+
+
+def test_coalescer_fails_window_on_api_error():
+    error = RuntimeError("rate limited")
+    chat = FakeChat(replies=[error])
+    results, remembered = coalesce(chat, ["a", "b", "c", "d"])
+
+    assert results == [error] * 4
+    assert len(chat.bodies) == 1
+    assert remembered == {}
+
+
+def test_coalescer_splits_unparsable_pack():
+    chat = FakeChat(replies=['{"1": {"command": "result = 1"'])
+    results, _ = coalesce(chat, ["a", "b", "c", "d"])
+
+    assert [json.loads(result)["command"] for result in results] == ["a", "b", "c", "d"]
+    assert len(chat.bodies) == 3